@@ -11,26 +11,376 @@
 ***************************************************************************
 """
 
+import os
+from pathlib import Path
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+from threading import Event, Lock
+
+import numpy as np
+
+from osgeo import gdal
 from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (
     QgsProcessing,
     QgsFeatureSink,
     QgsProcessingException,
-    QgsProject,
     QgsProcessingAlgorithm,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterBoolean,
     QgsCoordinateTransform,
-    QgsCoordinateReferenceSystem,
     QgsField,
     QgsVectorLayer,
     QgsGeometry,
-    edit,
-    QgsPointXY,
+    QgsPoint,
+    QgsPolygon,
     QgsFeature,
+    QgsFeatureRequest,
+    QgsVectorFileWriter,
+    QgsProcessingContext,
+    QgsProcessingOutputLayerDefinition,
+    QgsWkbTypes,
 )
-from qgis import processing
+
+from .utils import BNG, bng_transform
+
+try:
+    import shapely
+    import shapely.wkb
+
+    # shapely 2.x exposes contains_xy, vectorized.contains is 1.x only
+    if not hasattr(shapely, "contains_xy"):
+        import shapely.vectorized
+except ImportError:
+    shapely = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+if numba is not None:
+
+    # the kernel already runs across every core, and numba's default
+    # threading layer does not allow parallel kernels to be entered from
+    # several threads at once
+    PNPOLY_LOCK = Lock()
+
+    @numba.njit(parallel=True, cache=True, nogil=True)
+    def pnpoly(xs, ys, ring_x, ring_y, ring_offsets, boundary):
+        """
+        Even-odd ray casting test of each xs, ys point against the polygon
+        made up of the closed rings stored back to back in ring_x, ring_y.
+        Ring i runs from ring_offsets[i] up to ring_offsets[i + 1]. Points
+        lying on a ring are flagged as boundary, matching the contains and
+        intersects tests of the other backends.
+        """
+        inside = np.zeros(xs.shape[0], dtype=np.bool_)
+
+        for i in numba.prange(xs.shape[0]):
+            px = xs[i]
+            py = ys[i]
+            crossings = False
+            on_ring = False
+
+            for r in range(ring_offsets.shape[0] - 1):
+                j = ring_offsets[r + 1] - 1
+
+                for k in range(ring_offsets[r], ring_offsets[r + 1]):
+                    # collinear with the edge and within its extent
+                    if (
+                        min(ring_x[j], ring_x[k]) <= px <= max(ring_x[j], ring_x[k])
+                        and min(ring_y[j], ring_y[k]) <= py <= max(ring_y[j], ring_y[k])
+                        and (ring_x[k] - px) * (ring_y[j] - py)
+                        == (ring_x[j] - px) * (ring_y[k] - py)
+                    ):
+                        on_ring = True
+                        break
+
+                    if (ring_y[k] > py) != (ring_y[j] > py) and px < (
+                        ring_x[j] - ring_x[k]
+                    ) * (py - ring_y[k]) / (ring_y[j] - ring_y[k]) + ring_x[k]:
+                        crossings = not crossings
+                    j = k
+
+                if on_ring:
+                    break
+
+            inside[i] = boundary if on_ring else crossings
+
+        return inside
+
+
+def linear_polygon(part):
+    """
+    Returns the single part polygon part as a QgsPolygon made up of line
+    string rings. Curve polygons are segmentized even where every segment is
+    straight, as their rings are still compound curves.
+    """
+    polygon = part.constGet()
+    if QgsWkbTypes.flatType(polygon.wkbType()) != QgsWkbTypes.Polygon:
+        polygon = polygon.segmentize()
+
+    return polygon
+
+
+def polygon_rings(part):
+    """
+    Returns the vertices of every ring of the single part polygon part as
+    flat x and y arrays, along with the offset at which each ring starts.
+    """
+    polygon = linear_polygon(part)
+
+    rings = [polygon.exteriorRing()] + [
+        polygon.interiorRing(i) for i in range(polygon.numInteriorRings())
+    ]
+    ring_x = [np.asarray(ring.xVector(), dtype=np.float64) for ring in rings]
+    ring_y = [np.asarray(ring.yVector(), dtype=np.float64) for ring in rings]
+    ring_offsets = np.cumsum([0] + [len(x) for x in ring_x])
+
+    return np.concatenate(ring_x), np.concatenate(ring_y), ring_offsets
+
+
+# number of points tested against a part at a time, between which a
+# cancelled run is picked up
+CONTAINS_CHUNK = 65536
+
+
+def part_contains(part, xs, ys, boundary=False, cancelled=None):
+    """
+    Returns a boolean array flagging which of the xs, ys coordinate pairs
+    fall within the single part geometry part, or on its boundary too when
+    boundary is set. The test is done in bulk with the numba ray casting
+    kernel or against a prepared shapely geometry where either is available,
+    otherwise each point is tested in turn against a prepared QGIS geometry
+    engine. Points are tested CONTAINS_CHUNK at a time, and CancelledError is
+    raised between chunks once the cancelled event is set.
+    """
+    if numba is not None:
+        ring_x, ring_y, ring_offsets = polygon_rings(part)
+        xs = xs.astype(np.float64)
+        ys = ys.astype(np.float64)
+
+        def test(xs, ys):
+            with PNPOLY_LOCK:
+                return pnpoly(xs, ys, ring_x, ring_y, ring_offsets, boundary)
+
+    elif shapely is None:
+        # prepared once, then each point is tested without wrapping it in a
+        # QgsGeometry of its own
+        engine = QgsGeometry.createGeometryEngine(part.constGet())
+        engine.prepareGeometry()
+        engine_test = engine.intersects if boundary else engine.contains
+
+        def test(xs, ys):
+            return np.fromiter(
+                (engine_test(QgsPoint(x, y)) for x, y in zip(xs.tolist(), ys.tolist())),
+                dtype=bool,
+                count=len(xs),
+            )
+
+    else:
+        shp_geom = shapely.wkb.loads(bytes(part.asWkb()))
+
+        if hasattr(shapely, "contains_xy"):
+            shapely.prepare(shp_geom)
+
+            def test(xs, ys):
+                if boundary:
+                    return shapely.intersects_xy(shp_geom, xs, ys)
+                return shapely.contains_xy(shp_geom, xs, ys)
+
+        else:
+            # vectorized.contains prepares the geometry itself
+            def test(xs, ys):
+                inside = shapely.vectorized.contains(shp_geom, xs, ys)
+                if boundary:
+                    inside |= shapely.vectorized.touches(shp_geom, xs, ys)
+                return inside
+
+    inside = np.empty(len(xs), dtype=bool)
+
+    for start in range(0, len(xs), CONTAINS_CHUNK):
+        if cancelled is not None and cancelled.is_set():
+            raise CancelledError()
+
+        stop = start + CONTAINS_CHUNK
+        inside[start:stop] = test(xs[start:stop], ys[start:stop])
+
+    return inside
+
+
+def polygon_parts(part):
+    """
+    Returns the exterior of the single part polygon part as a polygon without
+    holes, along with a polygon for each of its holes.
+    """
+    polygon = linear_polygon(part)
+
+    exterior = QgsGeometry(QgsPolygon(polygon.exteriorRing().clone()))
+    holes = [
+        QgsGeometry(QgsPolygon(polygon.interiorRing(i).clone()))
+        for i in range(polygon.numInteriorRings())
+    ]
+
+    return exterior, holes
+
+
+def in_bbox(bbox, xs, ys):
+    """
+    Returns a boolean array flagging which of the xs, ys coordinate pairs
+    fall inside the rectangle bbox.
+    """
+    return (
+        (xs >= bbox.xMinimum())
+        & (xs <= bbox.xMaximum())
+        & (ys >= bbox.yMinimum())
+        & (ys <= bbox.yMaximum())
+    )
+
+
+def points_within(part, xs, ys, cancelled=None):
+    """
+    Returns a boolean array flagging which of the xs, ys coordinate pairs
+    fall within the single part polygon part. The points are tested against
+    its exterior ring alone first. Only the points found inside the exterior
+    are then tested against each hole, and those falling in a hole are
+    dropped before the next one. Containment tests stop early once the
+    cancelled event is set.
+    """
+    exterior, holes = polygon_parts(part)
+
+    inside = np.flatnonzero(part_contains(exterior, xs, ys, cancelled=cancelled))
+
+    for hole in holes:
+        in_hole_bbox = np.flatnonzero(
+            in_bbox(hole.boundingBox(), xs[inside], ys[inside])
+        )
+        if not in_hole_bbox.size:
+            continue
+
+        # points on a hole's boundary are not within the polygon either
+        hits = inside[in_hole_bbox]
+        in_hole = part_contains(
+            hole, xs[hits], ys[hits], boundary=True, cancelled=cancelled
+        )
+
+        keep = np.ones(len(inside), dtype=bool)
+        keep[in_hole_bbox[in_hole]] = False
+        inside = inside[keep]
+
+    mask = np.zeros(len(xs), dtype=bool)
+    mask[inside] = True
+
+    return mask
+
+
+# little endian (1) 2D Point (1) well known binary layout
+POINT_WKB = np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def point_geometries(xs, ys):
+    """
+    Returns a list of point geometries for the xs, ys coordinate pairs. The
+    points are serialised to WKB in one numpy pass so each geometry is
+    created straight from its bytes.
+    """
+    wkb = np.empty(len(xs), dtype=POINT_WKB)
+    wkb["order"] = 1
+    wkb["type"] = 1
+    wkb["x"] = xs
+    wkb["y"] = ys
+
+    buffer = wkb.tobytes()
+    size = POINT_WKB.itemsize
+
+    points = []
+    for offset in range(0, len(buffer), size):
+        point = QgsGeometry()
+        point.fromWkb(buffer[offset : offset + size])
+        points.append(point)
+
+    return points
+
+
+def lattice(bbox, grid50):
+    """
+    Returns the eastings, northings and spacing of each British National Grid
+    aligned lattice covering the rectangle bbox. The 100m lattice is always
+    generated, the 50m points between them only when grid50 is set.
+    """
+    x_min = int(bbox.xMinimum())
+    y_min = int(bbox.yMinimum())
+    x_max = int(bbox.xMaximum())
+    y_max = int(bbox.yMaximum())
+
+    # first multiple of the spacing at or above the bounding box minimum
+    X, Y = np.meshgrid(
+        np.arange(((x_min + 99) // 100) * 100, x_max, 100),
+        np.arange(((y_min + 99) // 100) * 100, y_max, 100),
+    )
+    groups = [(X.ravel(), Y.ravel(), 100)]
+
+    if grid50:
+        xs50 = np.arange(((x_min + 49) // 50) * 50, x_max, 50)
+        ys50 = np.arange(((y_min + 49) // 50) * 50, y_max, 50)
+        X, Y = np.meshgrid(xs50, ys50)
+
+        # skip the cells already covered by the 100m lattice
+        off_100 = (xs50 % 100 != 0)[np.newaxis, :] | (ys50 % 100 != 0)[:, np.newaxis]
+        groups.append((X[off_100], Y[off_100], 50))
+
+    return groups
+
+
+def grid_points(geom, grid50, cancelled=None):
+    """
+    Returns the eastings, northings and spacings of the British National Grid
+    aligned points falling within geom, ordered row by row. The lattices are
+    generated over the bounding box of each part in turn, so parts far apart
+    do not share one lattice spanning the gap between them. Raises
+    CancelledError once the cancelled event is set.
+    """
+    parts = geom.asGeometryCollection() if geom.isMultipart() else [geom]
+
+    xs_in, ys_in, spacings = [], [], []
+
+    for part in parts:
+        if part.isEmpty():
+            continue
+
+        for X, Y, spacing in lattice(part.boundingBox(), grid50):
+            mask = points_within(part, X, Y, cancelled)
+            xs_in.append(X[mask])
+            ys_in.append(Y[mask])
+            spacings.append(np.full(np.count_nonzero(mask), spacing))
+
+    if not xs_in:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    xs_in = np.concatenate(xs_in)
+    ys_in = np.concatenate(ys_in)
+    spacings = np.concatenate(spacings)
+
+    # interleave the lattices of every part back into row by row order
+    order = np.lexsort((xs_in, ys_in))
+
+    return xs_in[order], ys_in[order], spacings[order]
+
+
+def process_feature(geom_wkb, grid50, cancelled=None):
+    """
+    Returns the eastings, northings and spacings of the grid points within
+    the feature geometry serialised as geom_wkb. Only plain values are passed
+    in so it can run on a worker thread, which gives up with CancelledError
+    once the cancelled event is set.
+    """
+    geom = QgsGeometry()
+    geom.fromWkb(geom_wkb)
+
+    return grid_points(geom, grid50, cancelled)
 
 
 class PeatDepthPoints(QgsProcessingAlgorithm):
@@ -55,6 +405,10 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
     OUTPUT = "OUTPUT"
     GRID50 = "GRID50"
 
+    # number of features handed to the output at a time, small enough for
+    # progress and cancelling to be picked up well within a second
+    WRITE_BATCH_SIZE = 10000
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -139,9 +493,7 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
         Create a peat depth point layer
         """
         peat_layer = QgsVectorLayer("Point", "peat_depth_points", "memory")
-        crs = peat_layer.crs()
-        crs.createFromId(27700)
-        peat_layer.setCrs(crs)
+        peat_layer.setCrs(BNG)
         pr = peat_layer.dataProvider()
 
         pr.addAttributes(
@@ -162,13 +514,164 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
 
         return peat_layer
 
-    def transform_geom(geom, crs):
-        coord_crs = QgsCoordinateReferenceSystem(crs)
-        bng = crs.createFromId(27700)
-        transform = QgsCoordinateTransform(coord_crs, bng, QgsProject.instance())
-        geom = transform.transform(geom)
+    @staticmethod
+    def transform_geom(geom, src_crs, ctx=None):
+        """
+        Transforms geom in place from src_crs to British National Grid and
+        returns it. The transform is taken from the shared cache unless a
+        transform context is given, and src_crs itself is left untouched.
+        """
+        if ctx is None:
+            transform = bng_transform(src_crs)
+        else:
+            transform = QgsCoordinateTransform(src_crs, BNG, ctx)
+
+        geom.transform(transform)
         return geom
 
+    def file_writer(self, parameters, context, fields, wkb_type, crs):
+        """
+        Returns a vector file writer for the output, along with its layer
+        source, when the output is a plain file. Returns None, None for any
+        other kind of destination, which is left to the processing feature
+        sink.
+        """
+        # read the destination directly, as parameterAsOutputLayer would also
+        # queue it to load on completion even when the sink is used instead
+        definition = parameters.get(self.OUTPUT)
+        create_options = {}
+        if isinstance(definition, QgsProcessingOutputLayerDefinition):
+            destination, _ = definition.sink.valueAsString(
+                context.expressionContext()
+            )
+            create_options = definition.createOptions
+        else:
+            destination = definition if isinstance(definition, str) else ""
+
+        if (
+            not destination
+            or destination == QgsProcessing.TEMPORARY_OUTPUT
+            or destination.startswith("memory:")
+            or "|" in destination
+        ):
+            return None, None
+
+        driver = QgsVectorFileWriter.driverForExtension(Path(destination).suffix)
+        if not driver:
+            return None, None
+
+        # honour the creation options set on the output, as parameterAsSink
+        # would for the same destination
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = driver
+        options.fileEncoding = create_options.get(
+            "fileEncoding", context.defaultEncoding()
+        )
+        if create_options.get("layerName"):
+            options.layerName = create_options["layerName"]
+
+        # fall back on the driver defaults where none are given, as the
+        # processing sink does
+        options.layerOptions = list(
+            create_options.get("layerOptions")
+            or QgsVectorFileWriter.defaultLayerOptions(driver)
+        )
+        options.datasourceOptions = list(
+            create_options.get("datasourceOptions")
+            or QgsVectorFileWriter.defaultDatasetOptions(driver)
+        )
+
+        # the writer already wraps its inserts in a single transaction, so
+        # syncing every page to disk is the remaining cost on geopackages. The
+        # option is read when the file is opened, and is set for this thread
+        # alone so other tasks opening geopackages meanwhile are unaffected.
+        synchronous = gdal.GetThreadLocalConfigOption("OGR_SQLITE_SYNCHRONOUS", None)
+        if driver == "GPKG":
+            gdal.SetThreadLocalConfigOption("OGR_SQLITE_SYNCHRONOUS", "OFF")
+
+        try:
+            writer = QgsVectorFileWriter.create(
+                destination, fields, wkb_type, crs, context.transformContext(), options
+            )
+        finally:
+            gdal.SetThreadLocalConfigOption("OGR_SQLITE_SYNCHRONOUS", synchronous)
+
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise QgsProcessingException(writer.errorMessage())
+
+        # point at the named layer rather than whichever the file opens with
+        if options.layerName:
+            destination = "{}|layername={}".format(destination, options.layerName)
+
+        # load the output once finished, as parameterAsSink would have done
+        if (
+            isinstance(definition, QgsProcessingOutputLayerDefinition)
+            and definition.destinationProject
+        ):
+            context.addLayerToLoadOnCompletion(
+                destination,
+                QgsProcessingContext.LayerDetails(
+                    definition.destinationName or self.tr("Output layer"),
+                    definition.destinationProject,
+                    self.OUTPUT,
+                ),
+            )
+
+        return writer, destination
+
+    def write_grid(self, sink, count, xs_in, ys_in, spacings, feedback, progress, step):
+        """
+        Writes the grid points to sink as peat layer features, with record ids
+        numbered on from count. The features are built and written a batch at
+        a time, moving the progress bar on from progress by up to step as they
+        are. Writing stops between batches once feedback is cancelled. Returns
+        the record id following the last point written.
+        """
+        for start in range(0, len(xs_in), self.WRITE_BATCH_SIZE):
+            # Stop the algorithm if cancel button has been clicked
+            if feedback.isCanceled():
+                break
+
+            xs = xs_in[start : start + self.WRITE_BATCH_SIZE]
+            ys = ys_in[start : start + self.WRITE_BATCH_SIZE]
+
+            points = point_geometries(xs, ys)
+
+            # attribute rows in peat layer field order, filled in positionally
+            attributes = [
+                [record_id, x, y, None, point_spacing, None, None, None, None, None]
+                for record_id, x, y, point_spacing in zip(
+                    range(count, count + len(points)),
+                    xs.tolist(),
+                    ys.tolist(),
+                    spacings[start : start + self.WRITE_BATCH_SIZE].tolist(),
+                )
+            ]
+
+            # attributes are positional, so the features do not need their
+            # own copy of the peat layer fields
+            feats = []
+            for point, row in zip(points, attributes):
+
+                feat = QgsFeature()
+                feat.setAttributes(row)
+                feat.setGeometry(point)
+                feats.append(feat)
+
+            if not sink.addFeatures(feats, QgsFeatureSink.FastInsert):
+                if isinstance(sink, QgsVectorFileWriter):
+                    raise QgsProcessingException(sink.errorMessage())
+                raise QgsProcessingException(sink.lastError())
+
+            count += len(points)
+
+            # Update the progress bar
+            feedback.setProgress(
+                int(progress + step * (start + len(points)) / len(xs_in))
+            )
+
+        return count
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
@@ -188,26 +691,6 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
         peat_wkb = peat_layer.wkbType()
         peat_crs = peat_layer.crs()
 
-        source_crs = source.sourceCrs()
-
-        # reproject layer if not EPSG:27700
-        if source_crs is not peat_crs:
-            feedback.pushInfo("Site outline layer not in EPSG:27700 - Reprojecting")
-            reproj = processing.run(
-                "qgis:reprojectlayer",
-                {
-                    "INPUT": source,
-                    "TARGET_CRS": "EPSG:27700",
-                    "OUTPUT": "memory:",
-                },
-            )
-            source = reproj["OUTPUT"]
-
-        if grid50 == True:
-            spacing = 50
-        else:
-            spacing = 100
-
         # If source was not found, throw an exception to indicate that the algorithm
         # encountered a fatal error. The exception text can be any string, but in this
         # case we use the pre-built invalidSourceError method to return a standard
@@ -217,15 +700,30 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
                 self.invalidSourceError(parameters, self.INPUT)
             )
 
-        (sink, dest_id) = self.parameterAsSink(
-            parameters,
-            self.OUTPUT,
-            context,
-            peat_fields,
-            peat_wkb,
-            peat_crs,
+        # only the geometries are needed, and any reprojection to EPSG:27700 is
+        # done on the fly as the features are read
+        request = QgsFeatureRequest().setNoAttributes()
+
+        if source.sourceCrs().authid() != peat_crs.authid():
+            feedback.pushInfo("Site outline layer not in EPSG:27700 - Reprojecting")
+            request.setDestinationCrs(peat_crs, context.transformContext())
+
+        # file outputs are streamed straight into a vector file writer,
+        # everything else goes through the processing feature sink
+        (sink, dest_id) = self.file_writer(
+            parameters, context, peat_fields, peat_wkb, peat_crs
         )
 
+        if sink is None:
+            (sink, dest_id) = self.parameterAsSink(
+                parameters,
+                self.OUTPUT,
+                context,
+                peat_fields,
+                peat_wkb,
+                peat_crs,
+            )
+
         # Send some information to the user
         # feedback.pushInfo("CRS is {}".format(peat_crs.authid()))
 
@@ -236,69 +734,78 @@ class PeatDepthPoints(QgsProcessingAlgorithm):
         if sink is None:
             raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
 
-        # Compute the number of steps to display within the progress bar and
         # get features from source
-        total = 100.0 / source.featureCount() if source.featureCount() else 0
-        features = source.getFeatures()
-
-        count = 1
-
-        for current, feature in enumerate(features):
-            # Stop the algorithm if cancel button has been clicked
-            if feedback.isCanceled():
-                break
-
-            # get geom and bounding box of feature
-            geom = feature.geometry()
-            bbox = geom.boundingBox()
-            x_max = int(bbox.xMaximum())
-            y_max = int(bbox.yMaximum())
-            x_min = int(bbox.xMinimum())
-            y_min = int(bbox.yMinimum())
+        features = source.getFeatures(request)
 
-            roundup = lambda a, b: a if a % b == 0 else a + b - a % b
+        # read the geometries up front so the grid for each feature can be
+        # generated on a worker thread
+        jobs = []
 
-            start_x = roundup(x_min, spacing)
-            start_y = roundup(y_min, spacing)
-            end_x = x_max
-            end_y = y_max
+        for feature in features:
+            # empty geometries have no usable bounding box to build a lattice on
+            if not feature.hasGeometry() or feature.geometry().isEmpty():
+                continue
 
-            y = start_y
+            jobs.append(feature.geometry().asWkb())
 
-            with edit(peat_layer):
+        # Compute the number of steps to display within the progress bar
+        total = 100.0 / len(jobs) if jobs else 0
 
-                while y < end_y:
-
-                    x = start_x
-
-                    while x < end_x:
-
-                        point = QgsGeometry.fromPointXY(QgsPointXY(x, y))
-
-                        if point.within(geom):
-
-                            feat = QgsFeature(peat_layer.fields())
-                            if x % 100 == 0 and y % 100 == 0:
-                                feat.setAttribute("spacing", 100)
-                            else:
-                                feat.setAttribute("spacing", 50)
-                            feat.setGeometry(point)
-                            feat.setAttribute("record_id", count)
-                            feat.setAttribute("easting", x)
-                            feat.setAttribute("northing", y)
-                            sink.addFeature(feat, QgsFeatureSink.FastInsert)
-
-                            count += 1
-
-                        x += spacing
-
-                    y += spacing
-
-            # Add a feature in the sink
-        # sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        count = 1
 
-        # Update the progress bar
-        feedback.setProgress(int(current * total))
+        # set to stop the workers between containment chunks, so none is left
+        # running, or holding the kernel lock, once the algorithm returns
+        cancelled = Event()
+
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        futures = [
+            executor.submit(process_feature, geom_wkb, grid50, cancelled)
+            for geom_wkb in jobs
+        ]
+
+        try:
+            for current in range(len(futures)):
+                future = futures[current]
+
+                # poll while the feature is generated so cancelling takes
+                # effect straight away rather than once the feature finishes
+                while not feedback.isCanceled():
+                    done, _ = wait([future], timeout=0.2)
+                    if done:
+                        break
+
+                # Stop the algorithm if cancel button has been clicked
+                if feedback.isCanceled():
+                    break
+
+                # each grid is written as soon as it and those before it are
+                # ready, one batch of features at a time
+                count = self.write_grid(
+                    sink,
+                    count,
+                    *future.result(),
+                    feedback=feedback,
+                    progress=current * total,
+                    step=total,
+                )
+
+                # release the written grid, only those still waiting their
+                # turn are held on to
+                futures[current] = future = None
+
+                # Update the progress bar
+                feedback.setProgress(int((current + 1) * total))
+        finally:
+            # queued features are dropped and running ones give up at their
+            # next chunk, so waiting on the workers here is brief
+            cancelled.set()
+            for pending in futures:
+                if pending is not None:
+                    pending.cancel()
+            executor.shutdown(wait=True)
+
+        # closing a file writer commits its transaction and flushes to disk
+        del sink
 
         # To run another Processing algorithm as part of this algorithm, you can use
         # processing.run(...). Make sure you pass the current context and feedback
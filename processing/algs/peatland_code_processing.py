@@ -23,17 +23,24 @@ from qgis.core import (
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterMultipleLayers,
     QgsProcessingParameterBoolean,
+    QgsProcessingUtils,
     QgsCoordinateTransform,
-    QgsCoordinateReferenceSystem,
+    QgsCsException,
     QgsField,
     QgsVectorLayer,
     QgsGeometry,
     edit,
     QgsPointXY,
     QgsFeature,
+    QgsFeatureRequest,
+    QgsSpatialIndex,
+    QgsMemoryProviderUtils,
+    QgsWkbTypes,
 )
 from qgis import processing
 
+from .utils import BNG
+
 
 class PeatlandCodeAssessmentBase(QgsProcessingAlgorithm):
     """
@@ -54,6 +61,9 @@ class PeatlandCodeAssessmentBase(QgsProcessingAlgorithm):
     # PEATLAND_TYPE = "PEATLAND_TYPE"
     NON_PEATLAND = "NON_PEATLAND"
 
+    # number of features written to the merged non-peatland layer at a time
+    BATCH_SIZE = 10000
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -145,6 +155,87 @@ class PeatlandCodeAssessmentBase(QgsProcessingAlgorithm):
         # We add a feature sink in which to store our processed features (this
         # usually takes the form of a newly created vector layer when the
         # algorithm is run in QGIS).
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT, self.tr("Assessment unit base")
+            )
+        )
+
+    def reproject(self, layer, context):
+        """
+        Returns a memory copy of layer in British National Grid, with the
+        features reprojected as they are read.
+        """
+        reprojected = QgsMemoryProviderUtils.createMemoryLayer(
+            layer.name(), layer.fields(), layer.wkbType(), BNG
+        )
+
+        request = QgsFeatureRequest().setDestinationCrs(BNG, context.transformContext())
+        reprojected.dataProvider().addFeatures(list(layer.getFeatures(request)))
+
+        return reprojected
+
+    def site_geometries(self, layer, site_index, site_engine, site_extent, context):
+        """
+        Yields the geometries of the features in layer which intersect the site
+        boundary, as multipolygons. Features are first screened against the
+        site spatial index, then tested against the prepared site geometry.
+        Invalid geometries are made valid before testing, as the prepared
+        geometry reports a GEOS error on them as no overlap.
+        """
+        request = QgsFeatureRequest().setFilterRect(site_extent).setNoAttributes()
+
+        # reproject on the fly rather than copying the layer into BNG first,
+        # the filter rect is then taken to be in BNG too
+        if layer.crs() != BNG:
+            request.setDestinationCrs(BNG, context.transformContext())
+
+        for feat in layer.getFeatures(request):
+            if not feat.hasGeometry():
+                continue
+
+            geom = feat.geometry()
+            if not site_index.intersects(geom.boundingBox()):
+                continue
+
+            if not geom.isGeosValid():
+                geom = geom.makeValid()
+                if geom.isNull():
+                    raise QgsProcessingException(
+                        self.tr("Feature {} of {} could not be made valid").format(
+                            feat.id(), layer.name()
+                        )
+                    )
+                # repairs can leave stray lines or points alongside the polygons
+                geom.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+
+            if site_engine.intersects(geom.constGet()):
+                geom.convertToMultiType()
+                yield geom
+
+    def run_child(self, alg_id, parameters, context, feedback):
+        """
+        Runs the processing algorithm alg_id as a child of this one, so it
+        reports progress and can be cancelled, and returns its output layer.
+        """
+        result = processing.run(
+            alg_id,
+            parameters,
+            context=context,
+            feedback=feedback,
+            is_child_algorithm=True,
+        )
+        return QgsProcessingUtils.mapLayerFromString(result["OUTPUT"], context)
+
+    def add_exclusions(self, provider, feats):
+        """
+        Adds the non-peatland features feats to provider, raising if any of
+        them are rejected so no exclusion is silently dropped.
+        """
+        # the provider hands back the added features alongside the result
+        ok, _ = provider.addFeatures(feats)
+        if not ok:
+            raise QgsProcessingException(provider.lastError())
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -158,6 +249,11 @@ class PeatlandCodeAssessmentBase(QgsProcessingAlgorithm):
             parameters=parameters, name=self.WATER_COURSE, context=context
         )
 
+        if source is None:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, self.INPUT)
+            )
+
         fields = QgsFields()
 
         (sink, dest_id) = self.parameterAsSink(
@@ -165,186 +261,160 @@ class PeatlandCodeAssessmentBase(QgsProcessingAlgorithm):
             self.OUTPUT,
             context,
             fields,
-            source.wkbType(),
-            source.sourceCrs(),
+            QgsWkbTypes.MultiPolygon,
+            BNG,
         )
 
-        if source is None:
-            raise QgsProcessingException(
-                self.invalidSourceError(parameters, self.INPUT)
-            )
-
-        for count, layer in enumerate(non_peatland_layers):
-            if layer.crs() is not QgsCoordinateReferenceSystem(27700):
-                non_peatland_layers[count] = processing.run(
-                    "qgis:reprojectlayer",
-                    {
-                        "INPUT": layer,
-                        "TARGET_CRS": "EPSG:27700",
-                        "OUTPUT": "memory:",
-                    },
-                )["OUTPUT"]
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
 
         if water_course is not None:
-            water_buffer = processing.run(
+            # buffer distance is in metres so the water course must be in BNG
+            if water_course.crs() != BNG:
+                water_course = self.reproject(water_course, context)
+
+            water_buffer = self.run_child(
                 "native:buffer",
                 {
                     "INPUT": water_course,
                     "DISTANCE": 30,
                     "DISSOLVE": True,
-                    "TARGET_CRS": "EPSG:27700",
-                    "OUTPUT": "memory:",
-                },
-            )["OUTPUT"]
-
-        if len(non_peatland_layers) > 1:
-            merged = processing.run(
-                "qgis:mergevectorlayers",
-                {
-                    "INPUT": non_peatland_layers,
                     "OUTPUT": "memory:",
                 },
-            )["OUTPUT"]
-        else:
-            merged = non_peatland_layers[0]
-
-        """
-        feedback.pushInfo("Starting processing algo")
-
-        # Retrieve the feature source and sink. The 'dest_id' variable is used
-        # to uniquely identify the feature sink, and must be included in the
-        # dictionary returned by the processAlgorithm function.
-        source = self.parameterAsVectorLayer(parameters, self.INPUT, context)
-
-        grid50 = self.parameterAsBool(parameters, self.GRID50, context)
-
-        peat_layer = self.generate_peat_layer()
-        peat_fields = peat_layer.fields()
-        peat_wkb = peat_layer.wkbType()
-        peat_crs = peat_layer.crs()
-
-        source_crs = source.sourceCrs()
+                context,
+                feedback,
+            )
 
-        # reproject layer if not EPSG:27700
-        if source_crs is not peat_crs:
-            reproj = processing.run(
-                "qgis:reprojectlayer",
-                {
-                    "INPUT": source,
-                    "TARGET_CRS": "EPSG:27700",
-                    "OUTPUT": "memory:",
-                },
+            if feedback.isCanceled():
+                return {self.OUTPUT: dest_id}
+
+        # index the site boundary so only non-peatland features touching it
+        # are carried through to the merge
+        site_features = list(
+            source.getFeatures(
+                QgsFeatureRequest()
+                .setNoAttributes()
+                .setDestinationCrs(BNG, context.transformContext())
             )
-            source = reproj["OUTPUT"]
+        )
+        if not site_features:
+            return {self.OUTPUT: dest_id}
 
-        if grid50 == True:
-            spacing = 50
-        else:
-            spacing = 100
+        site_index = QgsSpatialIndex()
+        site_index.addFeatures(site_features)
+        site_geom = QgsGeometry.unaryUnion([f.geometry() for f in site_features])
+        site_extent = site_geom.boundingBox()
 
-        # If source was not found, throw an exception to indicate that the algorithm
-        # encountered a fatal error. The exception text can be any string, but in this
-        # case we use the pre-built invalidSourceError method to return a standard
-        # helper text for when a source cannot be evaluated
-        if source is None:
-            raise QgsProcessingException(
-                self.invalidSourceError(parameters, self.INPUT)
-            )
+        site_engine = QgsGeometry.createGeometryEngine(site_geom.constGet())
+        site_engine.prepareGeometry()
 
-        (sink, dest_id) = self.parameterAsSink(
-            parameters,
-            self.OUTPUT,
+        # collect the non-peatland geometries straight into one memory layer,
+        # attributes are not needed for the difference against the site
+        merged = QgsMemoryProviderUtils.createMemoryLayer(
+            "non_peatland", QgsFields(), QgsWkbTypes.MultiPolygon, BNG
+        )
+        merged_pr = merged.dataProvider()
+
+        feats = []
+
+        for layer in non_peatland_layers:
+            extent = layer.extent()
+            if layer.crs() != BNG:
+                transform = QgsCoordinateTransform(
+                    layer.crs(), BNG, context.transformContext()
+                )
+                try:
+                    extent = transform.transformBoundingBox(extent)
+                except QgsCsException:
+                    # extents reaching beyond BNG can't be reprojected, the
+                    # features are screened one by one against the site instead
+                    extent = None
+
+            if extent is not None and not extent.intersects(site_extent):
+                continue
+
+            for geom in self.site_geometries(
+                layer, site_index, site_engine, site_extent, context
+            ):
+                feat = QgsFeature()
+                feat.setGeometry(geom)
+                feats.append(feat)
+
+                if len(feats) == self.BATCH_SIZE:
+                    self.add_exclusions(merged_pr, feats)
+                    feats = []
+
+        self.add_exclusions(merged_pr, feats)
+
+        # dissolve the non-peatland features and water buffer into a single
+        # exclusion geometry so each site feature needs only one difference
+        dissolved = self.run_child(
+            "native:dissolve",
+            {
+                "INPUT": merged,
+                "OUTPUT": "memory:",
+            },
             context,
-            peat_fields,
-            peat_wkb,
-            peat_crs,
+            feedback,
         )
 
-        # Send some information to the user
-        # feedback.pushInfo("CRS is {}".format(peat_crs.authid()))
+        if feedback.isCanceled():
+            return {self.OUTPUT: dest_id}
 
-        # If sink was not created, throw an exception to indicate that the algorithm
-        # encountered a fatal error. The exception text can be any string, but in this
-        # case we use the pre-built invalidSinkError method to return a standard
-        # helper text for when a sink cannot be evaluated
-        if sink is None:
-            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
-
-        # Compute the number of steps to display within the progress bar and
-        # get features from source
-        total = 100.0 / source.featureCount() if source.featureCount() else 0
-        features = source.getFeatures()
+        exclusions = [f.geometry() for f in dissolved.getFeatures()]
+        if water_course is not None:
+            exclusions += [f.geometry() for f in water_buffer.getFeatures()]
+
+        exclusion_geom = QgsGeometry()
+        exclusion_engine = None
+
+        if exclusions:
+            exclusion_geom = QgsGeometry.unaryUnion(exclusions)
+
+            # a failed union is null rather than empty, and would otherwise
+            # leave every site untouched
+            if exclusion_geom.isNull():
+                raise QgsProcessingException(
+                    self.tr("Could not dissolve the excluded areas: {}").format(
+                        exclusion_geom.lastError()
+                    )
+                )
+
+        if not exclusion_geom.isEmpty():
+            exclusion_engine = QgsGeometry.createGeometryEngine(
+                exclusion_geom.constGet()
+            )
+            exclusion_engine.prepareGeometry()
 
-        count = 1
+        total = 100.0 / len(site_features) if site_features else 0
 
-        for current, feature in enumerate(features):
+        for current, feature in enumerate(site_features):
             # Stop the algorithm if cancel button has been clicked
             if feedback.isCanceled():
                 break
 
-            # get geom and bounding box of feature
             geom = feature.geometry()
-            bbox = geom.boundingBox()
-            x_max = int(bbox.xMaximum())
-            y_max = int(bbox.yMaximum())
-            x_min = int(bbox.xMinimum())
-            y_min = int(bbox.yMinimum())
-
-            roundup = lambda a, b: a if a % b == 0 else a + b - a % b
-
-            start_x = roundup(x_min, spacing)
-            start_y = roundup(y_min, spacing)
-            end_x = x_max
-            end_y = y_max
-
-            y = start_y
-
-            with edit(peat_layer):
 
-                while y < end_y:
+            if exclusion_engine is not None and exclusion_engine.intersects(
+                geom.constGet()
+            ):
+                geom = geom.difference(exclusion_geom)
 
-                    x = start_x
+                # a failed difference is null rather than empty, and would
+                # otherwise drop the site as if it were wholly excluded
+                if geom.isNull():
+                    raise QgsProcessingException(
+                        self.tr("Could not remove the excluded areas: {}").format(
+                            geom.lastError()
+                        )
+                    )
 
-                    while x < end_x:
+            if not geom.isEmpty():
+                geom.convertToMultiType()
+                feat = QgsFeature(fields)
+                feat.setGeometry(geom)
+                sink.addFeature(feat, QgsFeatureSink.FastInsert)
 
-                        point = QgsGeometry.fromPointXY(QgsPointXY(x, y))
+            feedback.setProgress(int(current * total))
 
-                        if point.within(geom):
-
-                            feat = QgsFeature(peat_layer.fields())
-                            if x % 100 == 0 and y % 100 == 0:
-                                feat.setAttribute("spacing", 100)
-                            else:
-                                feat.setAttribute("spacing", 50)
-                            feat.setGeometry(point)
-                            feat.setAttribute("record_id", count)
-                            feat.setAttribute("easting", x)
-                            feat.setAttribute("northing", y)
-                            sink.addFeature(feat, QgsFeatureSink.FastInsert)
-
-                            count += 1
-
-                        x += spacing
-
-                    y += spacing
-
-            # Add a feature in the sink
-        # sink.addFeature(feature, QgsFeatureSink.FastInsert)
-
-        # Update the progress bar
-        feedback.setProgress(int(current * total))
-
-        # To run another Processing algorithm as part of this algorithm, you can use
-        # processing.run(...). Make sure you pass the current context and feedback
-        # to processing.run to ensure that all temporary layer outputs are available
-        # to the executed algorithm, and that the executed algorithm can send feedback
-        # reports to the user (and correctly handle cancellation and progress reports!)
-
-        # Return the results of the algorithm. In this case our only result is
-        # the feature sink which contains the processed features, but some
-        # algorithms may return multiple feature sinks, calculated numeric
-        # statistics, etc. These should all be included in the returned
-        # dictionary, with keys matching the feature corresponding parameter
-        # or output names.
         return {self.OUTPUT: dest_id}
-        """
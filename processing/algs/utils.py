@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from functools import lru_cache
+
+from qgis.core import (
+    QgsProject,
+    QgsCoordinateTransform,
+    QgsCoordinateReferenceSystem,
+)
+
+# British National Grid, the CRS all peatland outputs are created in
+BNG = QgsCoordinateReferenceSystem.fromEpsgId(27700)
+
+
+def crs_definition(crs):
+    """
+    Returns a string which identifies crs, its authority id where it has one
+    or its WKT otherwise.
+    """
+    return crs.authid() or crs.toWkt()
+
+
+@lru_cache(maxsize=64)
+def cached_transform(src_definition, dst_definition):
+    """
+    Returns a transform between the CRS definitions src_definition and
+    dst_definition, built once per pair and reused on later calls.
+    """
+    return QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem(src_definition),
+        QgsCoordinateReferenceSystem(dst_definition),
+        QgsProject.instance(),
+    )
+
+
+def bng_transform(src_crs):
+    """
+    Returns a transform from src_crs to British National Grid, reusing the
+    transform built for an earlier layer in the same CRS.
+    """
+    return cached_transform(crs_definition(src_crs), crs_definition(BNG))
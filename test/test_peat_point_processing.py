@@ -0,0 +1,298 @@
+# coding=utf-8
+"""Peat depth point generation tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = "joekbullard@gmail.com"
+__date__ = "2026-10-14"
+__copyright__ = "Copyright 2023, Joe Bullard"
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import CancelledError
+from threading import Event
+
+from qgis.core import (
+    QgsGeometry,
+    QgsProcessing,
+    QgsProcessingContext,
+    QgsProcessingOutputLayerDefinition,
+    QgsProcessingFeedback,
+    QgsProcessingUtils,
+    QgsProject,
+)
+
+from .utilities import from_bng, get_qgis_app, memory_layer
+
+QGIS_APP = get_qgis_app()
+
+from ..processing.algs import peat_point_processing  # noqa: E402
+from ..processing.algs.peat_point_processing import (  # noqa: E402
+    PeatDepthPoints,
+    grid_points,
+)
+
+
+def grid(wkt, grid50):
+    """Returns the (easting, northing, spacing) grid points within wkt."""
+    xs, ys, spacings = grid_points(QgsGeometry.fromWkt(wkt), grid50)
+    return list(zip(xs.tolist(), ys.tolist(), spacings.tolist()))
+
+
+class PeatPointGridTest(unittest.TestCase):
+    """Test the peat point lattices are generated correctly."""
+
+    SITE = "POLYGON((10 10, 290 10, 290 190, 10 190, 10 10))"
+
+    # containment backend under test, those preferred over it are patched out
+    BACKEND = "numba"
+
+    def setUp(self):
+        """Leave only the backend under test available for containment."""
+        # the geometry engine comes with QGIS, the others are optional
+        if self.BACKEND != "engine":
+            if getattr(peat_point_processing, self.BACKEND) is None:
+                self.skipTest("{} is not installed".format(self.BACKEND))
+
+        disabled = {"numba": [], "shapely": ["numba"], "engine": ["numba", "shapely"]}
+        for name in disabled[self.BACKEND]:
+            patcher = mock.patch.object(peat_point_processing, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_grid_100(self):
+        """Only the 100m lattice is generated without GRID50."""
+        self.assertEqual(grid(self.SITE, False), [(100, 100, 100), (200, 100, 100)])
+
+    def test_grid_50(self):
+        """The 50m points are interleaved with the 100m lattice row by row."""
+        expected = [(x, 50, 50) for x in range(50, 300, 50)]
+        expected += [
+            (x, 100, 100 if x % 100 == 0 else 50) for x in range(50, 300, 50)
+        ]
+        expected += [(x, 150, 50) for x in range(50, 300, 50)]
+
+        self.assertEqual(grid(self.SITE, True), expected)
+
+    def test_multipart(self):
+        """Each part of a multipart site contributes its own points."""
+        points = grid(
+            "MULTIPOLYGON(((10 10, 190 10, 190 190, 10 190, 10 10)),"
+            "((1010 10, 1190 10, 1190 190, 1010 190, 1010 10)))",
+            False,
+        )
+        self.assertEqual(points, [(100, 100, 100), (1100, 100, 100)])
+
+    def test_hole(self):
+        """Points on the exterior or a hole's edge, or inside a hole, are dropped."""
+        points = grid(
+            "POLYGON((0 0, 400 0, 400 400, 0 400, 0 0),"
+            "(100 100, 300 100, 300 300, 100 300, 100 100))",
+            True,
+        )
+        expected = [
+            (x, y, 100 if x % 100 == 0 and y % 100 == 0 else 50)
+            for y in range(50, 400, 50)
+            for x in range(50, 400, 50)
+            if not (100 <= x <= 300 and 100 <= y <= 300)
+        ]
+
+        self.assertEqual(points, expected)
+
+    def test_shared_edge(self):
+        """Points on an edge shared by two parts are within neither."""
+        points = grid(
+            "MULTIPOLYGON(((10 10, 100 10, 100 190, 10 190, 10 10)),"
+            "((100 10, 290 10, 290 190, 100 190, 100 10)))",
+            False,
+        )
+        self.assertEqual(points, [(200, 100, 100)])
+
+    def test_curve_polygon(self):
+        """Curve polygons are tested as their segmentized rings."""
+        points = grid(
+            "CURVEPOLYGON(COMPOUNDCURVE((10 10, 290 10, 290 190, 10 190, 10 10)))",
+            False,
+        )
+        self.assertEqual(points, [(100, 100, 100), (200, 100, 100)])
+
+    def test_cancelled(self):
+        """Grid generation gives up once the cancelled event is set."""
+        geom = QgsGeometry.fromWkt(self.SITE)
+        cancelled = Event()
+        cancelled.set()
+
+        with self.assertRaises(CancelledError):
+            grid_points(geom, True, cancelled)
+
+
+class ShapelyPeatPointGridTest(PeatPointGridTest):
+    """Test the peat point lattices with shapely containment."""
+
+    BACKEND = "shapely"
+
+
+class EnginePeatPointGridTest(PeatPointGridTest):
+    """Test the peat point lattices with QGIS geometry engine containment."""
+
+    BACKEND = "engine"
+
+
+class PeatDepthPointsTest(unittest.TestCase):
+    """Test the peat depth point algorithm output."""
+
+    FIELDS = [
+        "record_id",
+        "easting",
+        "northing",
+        "date",
+        "spacing",
+        "peat_depth",
+        "main_con",
+        "sub_con",
+        "notes",
+        "photo",
+    ]
+
+    SITES = [
+        "POLYGON((10 10, 290 10, 290 190, 10 190, 10 10))",
+        "POLYGON((1010 10, 1190 10, 1190 190, 1010 190, 1010 10))",
+    ]
+
+    ROWS = [(1, 100, 100, 100), (2, 200, 100, 100), (3, 1100, 100, 100)]
+
+    def run_points(self, wkts, output="memory:", crs="EPSG:27700", context=None):
+        """
+        Runs the algorithm on the wkts sites, returning the output layer
+        source, field names and rows.
+        """
+        if context is None:
+            context = QgsProcessingContext()
+        feedback = QgsProcessingFeedback()
+
+        alg = PeatDepthPoints()
+        alg.initAlgorithm()
+        results, ok = alg.run(
+            {"INPUT": memory_layer(wkts, crs=crs), "GRID50": False, "OUTPUT": output},
+            context,
+            feedback,
+        )
+        self.assertTrue(ok)
+
+        layer = QgsProcessingUtils.mapLayerFromString(results["OUTPUT"], context)
+        fields = [field.name() for field in layer.fields() if field.name() != "fid"]
+        rows = [
+            (f["record_id"], f["easting"], f["northing"], f["spacing"])
+            for f in layer.getFeatures()
+        ]
+        return results["OUTPUT"], fields, rows
+
+    def test_record_ids(self):
+        """Record ids run on from one feature to the next in source order."""
+        _, fields, rows = self.run_points(self.SITES)
+
+        self.assertEqual(fields, self.FIELDS)
+        self.assertEqual(rows, self.ROWS)
+
+    def test_file_outputs(self):
+        """File outputs are written straight to geopackages and shapefiles."""
+        for extension in ("gpkg", "shp"):
+            with self.subTest(extension=extension):
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = os.path.join(tmp, "points.{}".format(extension))
+                    dest_id, fields, rows = self.run_points(self.SITES, path)
+
+                self.assertEqual(dest_id, path)
+                self.assertEqual(fields, self.FIELDS)
+                self.assertEqual(rows, self.ROWS)
+
+    def test_file_output_layer_name(self):
+        """A layer name set on the output is written to and returned."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "points.gpkg")
+            output = QgsProcessingOutputLayerDefinition(path)
+            output.createOptions = {"layerName": "survey"}
+
+            dest_id, fields, rows = self.run_points(self.SITES, output)
+
+        self.assertEqual(dest_id, path + "|layername=survey")
+        self.assertEqual(fields, self.FIELDS)
+        self.assertEqual(rows, self.ROWS)
+
+    def test_file_output_default_options(self):
+        """Driver default options apply where the output gives none."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "points.csv")
+            self.run_points(self.SITES, path)
+
+            with open(path) as csv:
+                header = csv.readline().strip().split(",")
+
+        # the CSV driver defaults to writing point coordinates as columns
+        self.assertEqual(header[:2], ["X", "Y"])
+
+    def test_layers_to_load(self):
+        """Outputs bound for a project are queued to load exactly once."""
+        project = QgsProject.instance()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            named = QgsProcessingOutputLayerDefinition(
+                os.path.join(tmp, "named.gpkg"), project
+            )
+            named.createOptions = {"layerName": "survey"}
+
+            outputs = [
+                QgsProcessingOutputLayerDefinition(
+                    QgsProcessing.TEMPORARY_OUTPUT, project
+                ),
+                QgsProcessingOutputLayerDefinition(
+                    os.path.join(tmp, "points.shp"), project
+                ),
+                named,
+            ]
+
+            for output in outputs:
+                with self.subTest(sink=output.sink.staticValue()):
+                    context = QgsProcessingContext()
+                    dest_id, _, rows = self.run_points(
+                        self.SITES, output, context=context
+                    )
+
+                    self.assertEqual(
+                        list(context.layersToLoadOnCompletion()), [dest_id]
+                    )
+                    self.assertEqual(rows, self.ROWS)
+
+    def test_reprojected_sites(self):
+        """Sites outside BNG are reprojected before the grid is generated."""
+        _, _, rows = self.run_points(
+            [from_bng(wkt, "EPSG:3857") for wkt in self.SITES], crs="EPSG:3857"
+        )
+        self.assertEqual(rows, self.ROWS)
+
+    def test_empty_geometry(self):
+        """Features with an empty geometry produce no points."""
+        _, _, rows = self.run_points(
+            [self.SITES[0], "POLYGON EMPTY", self.SITES[1]]
+        )
+        self.assertEqual(rows, self.ROWS)
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite(
+        unittest.makeSuite(case)
+        for case in (
+            PeatPointGridTest,
+            ShapelyPeatPointGridTest,
+            EnginePeatPointGridTest,
+            PeatDepthPointsTest,
+        )
+    )
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
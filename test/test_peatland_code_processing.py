@@ -0,0 +1,148 @@
+# coding=utf-8
+"""Peatland code assessment unit base tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = "joekbullard@gmail.com"
+__date__ = "2026-10-14"
+__copyright__ = "Copyright 2023, Joe Bullard"
+
+import unittest
+
+from qgis.analysis import QgsNativeAlgorithms
+from qgis.core import (
+    QgsApplication,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProcessingUtils,
+)
+
+from .utilities import from_bng, get_qgis_app, memory_layer
+
+QGIS_APP = get_qgis_app()
+
+from ..processing.algs.peatland_code_processing import (  # noqa: E402
+    PeatlandCodeAssessmentBase,
+)
+
+
+# well clear of the 1km square site
+OUTSIDE = "POLYGON((5000 5000, 5100 5000, 5100 5100, 5000 5100, 5000 5000))"
+
+
+class PeatlandCodeAssessmentBaseTest(unittest.TestCase):
+    """Test non-peatland features are removed from the site boundary."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Register the native algorithms used for dissolving."""
+        registry = QgsApplication.processingRegistry()
+        if registry.providerById("native") is None:
+            registry.addProvider(QgsNativeAlgorithms())
+
+    def run_assessment(self, non_peatland, water_course=None):
+        """Runs the assessment on a 1km square site, returning the output."""
+        site = memory_layer(["POLYGON((0 0, 1000 0, 1000 1000, 0 1000, 0 0))"])
+
+        context = QgsProcessingContext()
+        feedback = QgsProcessingFeedback()
+
+        parameters = {"INPUT": site, "NON_PEATLAND": non_peatland, "OUTPUT": "memory:"}
+        if water_course is not None:
+            parameters["WATER_COURSE"] = water_course
+
+        alg = PeatlandCodeAssessmentBase()
+        alg.initAlgorithm()
+        results, ok = alg.run(parameters, context, feedback)
+        self.assertTrue(ok)
+
+        output = QgsProcessingUtils.mapLayerFromString(results["OUTPUT"], context)
+        return [f.geometry() for f in output.getFeatures()]
+
+    def test_non_peatland_removed(self):
+        """Overlapping non-peatland features are cut out of the site."""
+        geoms = self.run_assessment(
+            [
+                # overlaps the south west corner of the site
+                memory_layer(
+                    ["POLYGON((-100 -100, 200 -100, 200 200, -100 200, -100 -100))"]
+                ),
+                # one feature inside the site, one outside it
+                memory_layer(
+                    ["POLYGON((400 400, 500 400, 500 500, 400 500, 400 400))", OUTSIDE]
+                ),
+            ]
+        )
+
+        self.assertEqual(len(geoms), 1)
+        self.assertAlmostEqual(geoms[0].area(), 1000000 - 40000 - 10000)
+
+    def test_invalid_non_peatland(self):
+        """Self-intersecting non-peatland features are repaired, not skipped."""
+        # a bowtie of two 10000m2 triangles meeting at (200 200)
+        geoms = self.run_assessment(
+            [memory_layer(["POLYGON((100 100, 300 300, 300 100, 100 300, 100 100))"])]
+        )
+
+        self.assertEqual(len(geoms), 1)
+        self.assertAlmostEqual(geoms[0].area(), 1000000 - 20000)
+
+    def test_water_course_buffer_removed(self):
+        """The 30m water course buffer is cut out along with non-peatland."""
+        geoms = self.run_assessment(
+            # straddles the water course, partly overlapping its buffer
+            [memory_layer(["POLYGON((400 400, 600 400, 600 500, 400 500, 400 400))"])],
+            # runs north to south through the middle of the site
+            memory_layer(["LINESTRING(500 -100, 500 1100)"], "LineString"),
+        )
+
+        self.assertEqual(len(geoms), 1)
+        self.assertEqual(geoms[0].constGet().numGeometries(), 2)
+        self.assertAlmostEqual(geoms[0].area(), 1000000 - 60000 - 20000 + 6000)
+
+    def test_invalid_non_peatland_with_water_course(self):
+        """Repaired non-peatland features are unioned with the water buffer."""
+        geoms = self.run_assessment(
+            # a bowtie meeting at (200 200), its middle within the buffer
+            [memory_layer(["POLYGON((100 100, 300 300, 300 100, 100 300, 100 100))"])],
+            memory_layer(["LINESTRING(200 -100, 200 1100)"], "LineString"),
+        )
+
+        # each triangle reaches 70m beyond the buffer, 100^2 - 30^2 of its area
+        self.assertEqual(len(geoms), 1)
+        self.assertEqual(geoms[0].constGet().numGeometries(), 2)
+        self.assertAlmostEqual(geoms[0].area(), 1000000 - 60000 - 2 * 9100)
+
+    def test_reprojected_layers(self):
+        """Non-peatland and water course layers outside BNG are reprojected."""
+        corner = "POLYGON((-100 -100, 200 -100, 200 200, -100 200, -100 -100))"
+
+        geoms = self.run_assessment(
+            [memory_layer([from_bng(corner, "EPSG:3857")], crs="EPSG:3857")],
+            memory_layer(
+                [from_bng("LINESTRING(500 -100, 500 1100)", "EPSG:4326")],
+                "LineString",
+                "EPSG:4326",
+            ),
+        )
+
+        self.assertEqual(len(geoms), 1)
+        self.assertAlmostEqual(geoms[0].area(), 1000000 - 40000 - 60000, delta=50)
+
+    def test_non_peatland_clear_of_site(self):
+        """The site is unchanged when no non-peatland feature touches it."""
+        geoms = self.run_assessment([memory_layer([OUTSIDE])])
+
+        self.assertEqual(len(geoms), 1)
+        self.assertAlmostEqual(geoms[0].area(), 1000000)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PeatlandCodeAssessmentBaseTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -59,3 +59,66 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+def memory_layer(wkts, geometry_type="Polygon", crs="EPSG:27700"):
+    """Create a memory layer holding one feature per WKT geometry.
+
+    :param wkts: WKT strings for the features to add.
+    :type wkts: list
+
+    :param geometry_type: Geometry type of the layer, e.g. Polygon.
+    :type geometry_type: str
+
+    :param crs: Authority id of the layer CRS.
+    :type crs: str
+
+    :returns: The populated memory layer.
+    :rtype: QgsVectorLayer
+    """
+    from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+
+    layer = QgsVectorLayer(
+        "{}?crs={}".format(geometry_type, crs), "test_layer", "memory"
+    )
+
+    features = []
+    for wkt in wkts:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        features.append(feature)
+
+    layer.dataProvider().addFeatures(features)
+    layer.updateExtents()
+
+    return layer
+
+
+def from_bng(wkt, crs):
+    """Reproject a British National Grid WKT geometry.
+
+    :param wkt: WKT string of the geometry in EPSG:27700.
+    :type wkt: str
+
+    :param crs: Authority id of the CRS to reproject into.
+    :type crs: str
+
+    :returns: WKT string of the reprojected geometry.
+    :rtype: str
+    """
+    from qgis.core import (
+        QgsCoordinateReferenceSystem,
+        QgsCoordinateTransform,
+        QgsGeometry,
+        QgsProject,
+    )
+
+    geom = QgsGeometry.fromWkt(wkt)
+    geom.transform(
+        QgsCoordinateTransform(
+            QgsCoordinateReferenceSystem("EPSG:27700"),
+            QgsCoordinateReferenceSystem(crs),
+            QgsProject.instance(),
+        )
+    )
+    return geom.asWkt()